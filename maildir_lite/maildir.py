@@ -1,14 +1,33 @@
 import datetime
+import errno
+import hashlib
+import json
 import logging
 import os
+import re
+import threading
 import time
-from .message import Message
+import weakref
+from .message import Message, gen_msgid
 
 
 log = logging.getLogger(__name__)
 
 XATTR_MD5SUM = b"user.md5sum"
 XATTR_DATE = b"user.date"
+XATTR_STRUCTURE = b"user.mimestructure"
+
+# Longest piece of an mbox line read at once, and how many imported
+# messages are added to the key index at a time.
+MBOX_CHUNK_SIZE = 65536
+MBOX_BATCH_SIZE = 500
+
+# mbox Status/X-Status letters and the Maildir flags they map to.
+MBOX_STATUS_FLAGS = {"R": "S"}
+MBOX_XSTATUS_FLAGS = {"A": "R", "F": "F", "T": "D", "D": "T"}
+
+_MBOX_QUOTED_FROM = re.compile(rb">+From ")
+_MBOX_FROM = re.compile(rb">*From ")
 
 try:
     import xattr
@@ -28,14 +47,93 @@ class NoSuchMailboxError(InvalidMaildirError):
     pass
 
 
+class _KeyIndex(object):
+    """
+    The message keys of one maildir path, shared by every Maildir open on it.
+    
+    A refresh builds a new `keys` dict and swaps it in; every other change
+    edits `keys` and `structures` in place. Both happen while holding `lock`.
+    Readers take no lock: they only do single lookups or list(keys), which
+    CPython's GIL makes atomic with respect to those changes.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.keys = {}
+        self.structures = {}
+        self.last_update = 0
+        self.lock = threading.RLock()
+
+
+# Indexes live as long as some Maildir still references them.
+_indexes = weakref.WeakValueDictionary()
+_indexes_lock = threading.Lock()
+
+
+def _key_index(path):
+    with _indexes_lock:
+        index = _indexes.get(path)
+        if index is None:
+            index = _KeyIndex(path)
+            _indexes[path] = index
+        return index
+
+
+class _MboxDelivery(object):
+    """
+    A message being streamed from an mbox file into tmp/.
+    """
+    def __init__(self, message):
+        self.message = message
+        self.tmp_path = None
+        self.out = None
+        self.md5 = hashlib.md5()
+        self.size = 0
+        self.pending = b""
+        self.in_headers = True
+        self.skipping = False
+        self.old = False
+        self.flags = set()
+    
+    def read_status(self, name, value):
+        if name == b"status":
+            self.old = self.old or "O" in value or "R" in value
+            table = MBOX_STATUS_FLAGS
+        else:
+            table = MBOX_XSTATUS_FLAGS
+        self.flags.update(table[c] for c in value if c in table)
+    
+    def write(self, data):
+        # Hold back a trailing blank line; it may be the mbox separator.
+        if self.pending:
+            self._write(self.pending)
+            self.pending = b""
+        if data in (b"\n", b"\r\n"):
+            self.pending = data
+        else:
+            self._write(data)
+    
+    def _write(self, data):
+        self.out.write(data)
+        self.md5.update(data)
+        self.size += len(data)
+
+
+def _mbox_status_headers(status, xstatus, newline):
+    headers = b""
+    if status:
+        headers += b"Status: " + status.encode("ascii") + newline
+    if xstatus:
+        headers += b"X-Status: " + xstatus.encode("ascii") + newline
+    return headers
+
+
 class Maildir(object):
     _parent = None
     _use_xattrs = False
-    _last_update = 0
-    _keys = {}
+    _index = None
     
     path = None
-    paths = []
+    paths = None
     fs_layout = False
     
     # Turn on lazy updates if you do not expect this maildir to be
@@ -49,6 +147,7 @@ class Maildir(object):
         self.path = os.path.abspath(os.path.expanduser(path))
         self.lazy = lazy
         self.fs_layout = fs_layout
+        self._index = _key_index(self.path)
         if fs_layout == True:
             self.folder_seperator = "/"
         self.paths = {
@@ -86,9 +185,9 @@ class Maildir(object):
         
         # Turn on XATTRs, if we can/should.
         if xattr is True:
-            _use_xattrs = has_xattr
+            self._use_xattrs = has_xattr
         else:
-            _use_xattrs = False
+            self._use_xattrs = False
         
     def __getitem__(self, key):
         return self.get_message(key)
@@ -114,40 +213,55 @@ class Maildir(object):
     def __len__(self):
         return len(self.keys())
         
-    def _refresh_msgs(self):
-        update = False
+    def _needs_refresh(self):
+        index = self._index
+        if not index.keys:
+            return True
         
-        if not self._keys:
-            update = True
-        else:
-            if self.lazy:
-                if (self._last_update + self.lazy_period) > time.time():
-                    return
-            
-            for subdir in self.paths.values():
-                if os.path.getmtime(subdir) > (self._last_update + 2):
-                    update = True
-                    break;
+        if self.lazy:
+            if (index.last_update + self.lazy_period) > time.time():
+                return False
         
-        # Update keys
-        if update:
-            # log.debug("Refreshing message list for %r (%s; %d, %d)" % (self, self.name, self._last_update, len(self._keys)))
+        for subdir in (self.paths["new"], self.paths["cur"]):
+            if os.path.getmtime(subdir) > (index.last_update + 2):
+                return True
+        return False
+    
+    def _refresh_msgs(self, wait=True):
+        index = self._index
+        if not self._needs_refresh():
+            return
+        
+        # Without wait, readers keep using the current keys while another
+        # thread refreshes them.
+        if not index.lock.acquire(blocking=wait or not index.keys):
+            return
+        try:
+            # Someone else may have refreshed while we waited.
+            if not self._needs_refresh():
+                return
             
-            self._last_update = time.time()
-            self._keys = {}
+            last_update = time.time()
+            keys = {}
             
-            for subdir in self.paths.values():
+            # Messages in tmp/ are still being delivered and aren't ours to list.
+            for subdir in (self.paths["new"], self.paths["cur"]):
                 if os.path.isdir(subdir):
                     for dirent in os.scandir(subdir):
                         if dirent.name[0] == '.': continue
                         key = dirent.name.split(":")[0]
                         if dirent.is_file():
-                            self._keys[key] = dirent.path
+                            keys[key] = dirent.path
+            
+            index.keys = keys
+            index.last_update = last_update
+        finally:
+            index.lock.release()
         
     def _path_for_key(self, key):
         # First try to fetch the key without triggering a potentially expensive refresh.
         try:
-            path = self._keys[key]
+            path = self._index.keys[key]
             # Ensure the file exists and we don't have stale data.
             if os.path.exists(path):
                 return path
@@ -155,17 +269,22 @@ class Maildir(object):
             pass
             
         self._refresh_msgs()
-        path = self._keys[key]
+        path = self._index.keys[key]
         return path
     
     def move_message(self, key, maildir):
-        src_path = self._keys[key]
-        filename = os.path.basename(src_path)
-        dst_path = os.path.join(maildir.path, "new")
-        dst_path = os.path.join(dst_path, filename)
-
-        os.rename(src_path, dst_path)
-        del self._keys[key]
+        with self._index.lock:
+            src_path = self._path_for_key(key)
+            filename = os.path.basename(src_path)
+            dst_path = os.path.join(maildir.path, "new")
+            dst_path = os.path.join(dst_path, filename)
+            
+            os.rename(src_path, dst_path)
+            del self._index.keys[key]
+            self._index.structures.pop(key, None)
+        
+        with maildir._index.lock:
+            maildir._index.keys[key] = dst_path
         
     def _path_for_message(self, message):
         filename = message.msgid
@@ -209,7 +328,7 @@ class Maildir(object):
                     xattrs = xattr.listxattr(path)
                     # logging.debug(xattrs)
                     if XATTR_MD5SUM in xattrs:
-                        msg.msg_md5 = xattr.getxattr(path, XATTR_MD5SUM)
+                        msg.msg_md5 = xattr.getxattr(path, XATTR_MD5SUM).decode("utf8")
                         # logging.debug("Read md5: %s", msg.msg_md5)
                     else:
                         c = msg.content_hash
@@ -247,11 +366,15 @@ class Maildir(object):
         
         f = open(msg_path, "wb")
         f.write(msg.content)
-        f.close
+        f.close()
         
         try:
             if self._use_xattrs and msg.content_hash:
                 xattr.setxattr(msg_path, XATTR_MD5SUM, msg.content_hash)
+            if self._use_xattrs:
+                # Any stored structure described the old content.
+                if XATTR_STRUCTURE in xattr.listxattr(msg_path):
+                    xattr.removexattr(msg_path, XATTR_STRUCTURE)
         except IOError:
             # read-only FS, unsupported on FS, etc.
             self._use_xattrs = False
@@ -263,7 +386,13 @@ class Maildir(object):
             
     def get_message(self, key, load_content=True):
         msg_path = self._path_for_key(key)
-        msg = self._message_at_path(msg_path, load_content=load_content)
+        try:
+            msg = self._message_at_path(msg_path, load_content=load_content)
+        except KeyError:
+            # Renamed by another thread or process since we looked it up.
+            msg_path = self._path_for_key(key)
+            msg = self._message_at_path(msg_path, load_content=load_content)
+        
         if msg.subdir == "new":
             msg.subdir = "cur"
             self.update(key, msg)
@@ -271,6 +400,97 @@ class Maildir(object):
         
         return msg
         
+    def _open_message(self, key):
+        """
+        Opens a message's file for reading, following it if another thread or
+        process renamed it after we looked it up.
+        """
+        try:
+            return open(self._path_for_key(key), "rb")
+        except FileNotFoundError:
+            pass
+        
+        try:
+            return open(self._path_for_key(key), "rb")
+        except FileNotFoundError:
+            raise KeyError(key)
+    
+    def get_structure(self, key):
+        """
+        Returns the MIME part list of a message (see message.parse_structure).
+        
+        The list is cached and, with xattrs enabled, stored alongside the
+        message so it is only ever parsed once.
+        """
+        with self._open_message(key) as f:
+            return self._structure_for_file(key, f)
+    
+    def _structure_for_file(self, key, f):
+        size = os.fstat(f.fileno()).st_size
+        
+        cached = self._index.structures.get(key)
+        if cached and cached[0] == size:
+            return cached[1]
+        
+        parts = None
+        if self._use_xattrs:
+            try:
+                if XATTR_STRUCTURE in xattr.listxattr(f):
+                    stored = json.loads(xattr.getxattr(f, XATTR_STRUCTURE).decode("utf8"))
+                    if stored.get("size") == size:
+                        parts = stored["parts"]
+            except IOError:
+                self._use_xattrs = False
+                log.debug("host filesystem for %s does not support xattrs; disabling" % self.name)
+            except ValueError:
+                log.debug("ignoring unreadable structure xattr on %s", f.name)
+        
+        if parts is None:
+            f.seek(0)
+            content = f.read()
+            parts = Message(content=content, msgid=key).structure
+            size = len(content)
+            
+            if self._use_xattrs:
+                stored = json.dumps({"size": size, "parts": parts}, separators=(",", ":"))
+                try:
+                    xattr.setxattr(f, XATTR_STRUCTURE, stored.encode("utf8"))
+                except IOError as e:
+                    # Too large for this filesystem's xattr limits is not fatal.
+                    if e.errno not in (errno.E2BIG, errno.ENOSPC, errno.ERANGE):
+                        self._use_xattrs = False
+                        log.debug("host filesystem for %s does not support xattrs; disabling" % self.name)
+        
+        with self._index.lock:
+            # Don't bring back an entry for a message removed meanwhile.
+            if key in self._index.keys:
+                self._index.structures[key] = (size, parts)
+        return parts
+    
+    def get_part(self, key, part, headers=False):
+        """
+        Reads one MIME part of a message without loading the rest of it.
+        
+        Returns the raw (still transfer-encoded) body of the part, or its
+        header block if headers is True. Part numbers follow IMAP, with ""
+        being the whole message.
+        """
+        # One open file for both, so a concurrent rename can't get between.
+        with self._open_message(key) as f:
+            for entry in self._structure_for_file(key, f):
+                if entry["part"] == part:
+                    break
+            else:
+                raise KeyError(part)
+            
+            if headers:
+                start, end = entry["offset"], entry["body_offset"]
+            else:
+                start, end = entry["body_offset"], entry["end"]
+            
+            f.seek(start)
+            return f.read(end - start)
+    
     @property
     def is_subfolder(self):
         return (self._parent != None)
@@ -285,8 +505,8 @@ class Maildir(object):
         return name
     
     def keys(self):
-        self._refresh_msgs()
-        return self._keys.keys()
+        self._refresh_msgs(wait=False)
+        return list(self._index.keys)
     
     def add_message(self, msg):
         return self.add(content=msg.content, msgid=msg.msgid, subdir=msg.subdir, info=msg.info, mtime=msg.mtime, content_hash=msg.content_hash)
@@ -296,60 +516,331 @@ class Maildir(object):
             mtime = time.time()
         
         msg = Message(content=content, content_hash=content_hash, subdir="tmp", msgid=msgid, info=info, mtime=mtime)
+        
+        tmp_path, f = self._open_tmp(msg)
+        try:
+            with f:
+                f.write(msg.content)
+            os.utime(tmp_path, (msg.mtime, msg.mtime))
+            
+            try:
+                if self._use_xattrs and msg.content_hash:
+                    xattr.setxattr(tmp_path, XATTR_MD5SUM, msg.content_hash)
+            except IOError:
+                # read-only FS, unsupported on FS, etc.
+                self._use_xattrs = False
+                log.debug("host filesystem for %s does not support xattrs; disabling" % self.name)
+            
+            # Now that it's written out, move it to the proper destination.
+            if subdir:
+                msg.subdir = subdir
+            elif msg.flags:
+                msg.subdir = "cur"
+            else:
+                msg.subdir = "new"
+            
+            with self._index.lock:
+                # Generated IDs are unique by construction (and by O_EXCL in
+                # tmp/), but one handed to us may already be in use here.
+                if msgid:
+                    while self._msgid_in_use(msg):
+                        msg.msg_id = gen_msgid()
                 
-        # Ensure we have a unique ID, as much as possible.
-        while msg.msgid in self.keys():
-            msg.msgid = msg._gen_msgid()
-        
-        # Write to tmp and update metadata
-        self._write_message(msg)
-        self._keys[msg.msgid] = self._path_for_message(msg)
-        
-        # Now that it's written out, move it to the proper destination.
-        if subdir:
-            msg.subdir = subdir
-        elif msg.flags:
-            msg.subdir = "cur"
-        else:
-            msg.subdir = "new"
+                msg_path = self._path_for_message(msg)
+                os.rename(tmp_path, msg_path)
+                self._index.keys[msg.msgid] = msg_path
+        except:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
         
-        return self.update(msg.msgid, msg)
+        return msg.msgid
+    
+    def _msgid_in_use(self, msg):
+        """
+        Checks msg's key against the key index, rescanning only if the index
+        is empty or out of date, and against the names it could collide with
+        since the last scan.
+        """
+        self._refresh_msgs()
+        
+        key = msg.msgid
+        if key in self._index.keys:
+            return True
+        
+        candidates = (
+            os.path.join(self.paths["new"], key),
+            os.path.join(self.paths["cur"], key),
+            self._path_for_message(msg),
+        )
+        return any(os.path.exists(path) for path in candidates)
+    
+    def _open_tmp(self, msg):
+        """
+        Exclusively creates a file for msg in tmp/, picking a new ID until the
+        name is unused. Returns the path and a binary file object.
+
+        The tmp/ name is the bare ID, not the final key with its MD5 and size;
+        this relies on _refresh_msgs never listing tmp/.
+        """
+        flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0)
+        while True:
+            tmp_path = os.path.join(self.paths["tmp"], msg.msg_id)
+            try:
+                fd = os.open(tmp_path, flags, 0o600)
+            except FileExistsError:
+                msg.msg_id = gen_msgid()
+                continue
+            return tmp_path, os.fdopen(fd, "wb")
     
     def update(self, key, msg):
         """
         Updates a message's ID and/or content.
         """
-        old_path = self._path_for_key(key)
-        old_stat = os.stat(old_path)
-        
-        # See if we have to rename it
-        new_path = self._path_for_message(msg)
-        if old_path and old_path != new_path:
-            os.rename(old_path, new_path)
-            self._keys[key] = new_path
+        index = self._index
+        with index.lock:
+            old_path = self._path_for_key(key)
+            old_stat = os.stat(old_path)
             
-            if self.lazy:
-                self._last_update = time.time()
-            else:
-                self._last_update = 0
-        
-        # Verify the content
-        new_stat = os.stat(new_path)
-        if not (old_stat and old_stat == new_stat):
-            log.debug("Checking message content (%r, %r)", old_stat, new_stat)
-            old_msg = self._message_at_path(new_path)
-            if old_msg.content != msg.content:
-                self._write_message(msg)
-            else:
-                # Check the file's mtime
-                if new_stat.st_mtime != msg.mtime:
-                    times = (msg.mtime, msg.mtime)
-                    os.utime(new_path, times)
+            # See if we have to rename it
+            new_path = self._path_for_message(msg)
+            if old_path and old_path != new_path:
+                os.rename(old_path, new_path)
+                index.keys[key] = new_path
+            
+            # Verify the content
+            new_stat = os.stat(new_path)
+            if not (old_stat and old_stat == new_stat):
+                log.debug("Checking message content (%r, %r)", old_stat, new_stat)
+                old_msg = self._message_at_path(new_path)
+                if old_msg.content != msg.content:
+                    self._write_message(msg)
+                    index.structures.pop(key, None)
+                else:
+                    # Check the file's mtime
+                    if new_stat.st_mtime != msg.mtime:
+                        times = (msg.mtime, msg.mtime)
+                        os.utime(new_path, times)
         return msg.msgid
     
     def remove(self, key):
-        os.remove(self._path_for_key(key))
-        del self._keys[key]
+        with self._index.lock:
+            os.remove(self._path_for_key(key))
+            del self._index.keys[key]
+            self._index.structures.pop(key, None)
+    
+    def import_mbox(self, mbox):
+        """
+        Delivers every message of an mbox file (a path or binary file object)
+        into this maildir, streaming each one straight to tmp/.
+        
+        Status and X-Status headers become Maildir flags and are dropped from
+        the delivered message. Returns the number of messages imported.
+        """
+        if hasattr(mbox, "read"):
+            f = mbox
+        else:
+            f = open(mbox, "rb")
+        
+        count = 0
+        batch = {}
+        msg = None
+        try:
+            line_start = True
+            while True:
+                line = f.readline(MBOX_CHUNK_SIZE)
+                if not line:
+                    break
+                
+                at_line_start = line_start
+                line_start = line.endswith(b"\n")
+                
+                # After the first message, only a From_ line following a blank
+                # line separates messages; any other is part of the body.
+                if at_line_start and line.startswith(b"From ") and (msg is None or msg.pending):
+                    # Consume the rest of an overlong From_ line.
+                    while not line_start:
+                        more = f.readline(MBOX_CHUNK_SIZE)
+                        if not more:
+                            break
+                        line_start = more.endswith(b"\n")
+                        if len(line) < MBOX_CHUNK_SIZE:
+                            line += more
+                    
+                    if msg and self._finish_mbox_message(msg, batch):
+                        count += 1
+                    msg = self._start_mbox_message(line)
+                    continue
+                
+                if msg is None:
+                    # Anything before the first From_ line is not a message.
+                    continue
+                
+                if msg.in_headers:
+                    if at_line_start:
+                        if line in (b"\n", b"\r\n"):
+                            msg.in_headers = False
+                            msg.skipping = False
+                        elif line[:1] not in (b" ", b"\t"):
+                            name = line.split(b":", 1)[0].strip().lower()
+                            msg.skipping = name in (b"status", b"x-status")
+                            if msg.skipping:
+                                value = line.split(b":", 1)[-1].decode("ascii", "ignore")
+                                msg.read_status(name, value)
+                    if msg.skipping:
+                        continue
+                
+                if at_line_start and _MBOX_QUOTED_FROM.match(line):
+                    line = line[1:]
+                msg.write(line)
+            
+            if msg and self._finish_mbox_message(msg, batch):
+                count += 1
+            
+        except:
+            if msg and os.path.exists(msg.tmp_path):
+                msg.out.close()
+                os.remove(msg.tmp_path)
+            raise
+        
+        finally:
+            if batch:
+                with self._index.lock:
+                    self._index.keys.update(batch)
+            if f is not mbox:
+                f.close()
+        
+        return count
+    
+    def _start_mbox_message(self, from_line):
+        mtime = None
+        try:
+            date = from_line.decode("ascii").split(None, 2)[2].strip()
+            mtime = time.mktime(time.strptime(date, "%a %b %d %H:%M:%S %Y"))
+        except (IndexError, UnicodeDecodeError, ValueError, OverflowError):
+            pass
+        
+        msg = _MboxDelivery(Message(subdir="tmp", mtime=mtime or time.time()))
+        msg.tmp_path, msg.out = self._open_tmp(msg.message)
+        return msg
+    
+    def _finish_mbox_message(self, msg, batch):
+        """
+        Moves a streamed message into place; returns False (and delivers
+        nothing) if it turned out to be empty.
+        """
+        # The blank line before the next From_ line is the separator.
+        msg.pending = b""
+        msg.out.close()
+        
+        if not msg.size:
+            os.remove(msg.tmp_path)
+            return False
+        
+        message = msg.message
+        message.msg_md5 = msg.md5.hexdigest()
+        message.msg_size = msg.size
+        message.flags = "".join(sorted(msg.flags))
+        message.subdir = "cur" if (msg.flags or msg.old) else "new"
+        
+        os.utime(msg.tmp_path, (message.mtime, message.mtime))
+        try:
+            if self._use_xattrs:
+                xattr.setxattr(msg.tmp_path, XATTR_MD5SUM, message.msg_md5)
+        except IOError:
+            # read-only FS, unsupported on FS, etc.
+            self._use_xattrs = False
+            log.debug("host filesystem for %s does not support xattrs; disabling" % self.name)
+        
+        msg_path = self._path_for_message(message)
+        os.rename(msg.tmp_path, msg_path)
+        
+        batch[message.msgid] = msg_path
+        if len(batch) >= MBOX_BATCH_SIZE:
+            with self._index.lock:
+                self._index.keys.update(batch)
+            batch.clear()
+        return True
+    
+    def export_mbox(self, mbox, keys=None):
+        """
+        Appends messages (all of them, or those in keys) to an mbox file (a
+        path or binary file object), streaming each from disk.
+        
+        Maildir flags are written as Status and X-Status headers, replacing
+        any already in the message. Returns the number of messages exported.
+        """
+        if hasattr(mbox, "write"):
+            out = mbox
+        else:
+            out = open(mbox, "ab")
+        
+        count = 0
+        try:
+            for key in (self.keys() if keys is None else keys):
+                try:
+                    msg_path = self._path_for_key(key)
+                    f = open(msg_path, "rb")
+                except (KeyError, OSError):
+                    # Removed since we listed it.
+                    continue
+                
+                with f:
+                    self._export_mbox_message(msg_path, f, out)
+                count += 1
+        finally:
+            if out is not mbox:
+                out.close()
+        
+        return count
+    
+    def _export_mbox_message(self, msg_path, f, out):
+        directory, filename = os.path.split(msg_path)
+        subdir = os.path.basename(directory)
+        info = filename.split(":", 1)[1] if ":" in filename else ""
+        flags = info[2:] if info.startswith("2,") else ""
+        
+        status = "".join(k for k, v in MBOX_STATUS_FLAGS.items() if v in flags)
+        if subdir == "cur":
+            status += "O"
+        xstatus = "".join(k for k, v in MBOX_XSTATUS_FLAGS.items() if v in flags)
+        
+        mtime = os.fstat(f.fileno()).st_mtime
+        out.write(b"From MAILER-DAEMON " + time.asctime(time.localtime(mtime)).encode("ascii") + b"\n")
+        
+        in_headers = True
+        skipping = False
+        line_start = True
+        last = b"\n"
+        while True:
+            line = f.readline(MBOX_CHUNK_SIZE)
+            if not line:
+                break
+            
+            at_line_start = line_start
+            line_start = line.endswith(b"\n")
+            
+            if in_headers and at_line_start:
+                if line in (b"\n", b"\r\n"):
+                    in_headers = False
+                    out.write(_mbox_status_headers(status, xstatus, line))
+                elif line[:1] not in (b" ", b"\t"):
+                    name = line.split(b":", 1)[0].strip().lower()
+                    skipping = name in (b"status", b"x-status")
+            if in_headers and skipping:
+                continue
+            
+            if at_line_start and _MBOX_FROM.match(line):
+                line = b">" + line
+            out.write(line)
+            last = line
+        
+        if not last.endswith(b"\n"):
+            out.write(b"\n")
+        if in_headers:
+            # Headers only; the separator below ends them.
+            out.write(_mbox_status_headers(status, xstatus, b"\n"))
+        out.write(b"\n")
     
     def _path_to_vpath(self, path):
         """
@@ -1,19 +1,216 @@
-import hashlib, logging
+import hashlib, logging, re
 
 # For standard Python message generation
 import email.utils, email.parser, email.policy
 
 #For the message UID
-import os, time, datetime, socket, random
+import os, time, datetime, socket, random, itertools
 
 
 log = logging.getLogger(__name__)
-delivery_number = 0
+
+# Per-process parts of generated message IDs; reset in forked children.
+_msgid_hostname = None
+_msgid_pid = None
+_delivery_numbers = itertools.count(1)
+
+
+def _reset_msgid_constants():
+    global _msgid_hostname, _msgid_pid, _delivery_numbers
+    # "/" and ":" are not allowed in Maildir filenames, and "," starts the
+    # size/MD5 properties we append to IDs.
+    hostname = socket.gethostname()
+    hostname = hostname.replace("/", "\\057").replace(":", "\\072").replace(",", "\\054")
+    _msgid_hostname = hostname
+    _msgid_pid = os.getpid()
+    _delivery_numbers = itertools.count(1)
+
+_reset_msgid_constants()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_msgid_constants)
+
+
+def gen_msgid():
+    """
+    Returns a new unique Maildir message ID for this host and process.
+    """
+    now = time.time()
+    seconds_number = int(now)
+    microsecond_number = int((now - seconds_number) * 1000000)
+    random_number = random.getrandbits(32)
+    delivery_number = next(_delivery_numbers)
+    
+    return "%d.R%dM%dP%dQ%d.%s" % (seconds_number, random_number, microsecond_number, _msgid_pid, delivery_number, _msgid_hostname)
+
+
+# Deeper nesting than this is treated as an opaque leaf part.
+MAX_MIME_DEPTH = 32
+
+_HEADER_END = re.compile(rb"\n\r?\n")
+
+
+def parse_structure(content):
+    """
+    Scans raw message bytes and returns a flat list of MIME parts.
+    
+    Each part is a dict with its IMAP part number ("" for the whole message),
+    content type, parameters, transfer encoding and the byte offsets of its
+    headers ("offset"), body ("body_offset") and end ("end"), so that a single
+    part can later be read straight from the file.
+    """
+    parts = []
+    if content is None:
+        return parts
+    
+    root = _parse_entity(content, 0, len(content), "")
+    parts.append(root)
+    _parse_children(content, root, "", parts, True, 0)
+    return parts
+
+
+def _subpart(part, number):
+    return "%s.%d" % (part, number) if part else str(number)
+
+
+def _header_str(headers, name):
+    value = headers.get(name)
+    return str(value) if value is not None else None
+
+
+def _parse_entity(content, start, end, part, default_type="text/plain"):
+    # Locate the blank line ending the header block.
+    if content.startswith(b"\r\n", start, end):
+        body_offset = start + 2
+    elif content.startswith(b"\n", start, end):
+        body_offset = start + 1
+    else:
+        m = _HEADER_END.search(content, start, end)
+        body_offset = m.end() if m else end
+    
+    entry = None
+    for policy in (email.policy.default, email.policy.compat32):
+        try:
+            entry = _header_fields(content[start:body_offset], policy, default_type)
+            break
+        except Exception:
+            # The stdlib's strict header parsing can fail outright on some
+            # malformed headers; try again with the lenient legacy parser.
+            continue
+    
+    if entry is None:
+        log.debug("unparseable MIME headers at offset %d; treating as opaque", start)
+        entry = {
+            "type": "application/octet-stream",
+            "params": {},
+            "id": None,
+            "description": None,
+            "encoding": "7bit",
+            "disposition": None,
+            "filename": None,
+        }
+    
+    entry.update({
+        "part": part,
+        "offset": start,
+        "body_offset": body_offset,
+        "end": end,
+        "size": end - body_offset,
+        "lines": content.count(b"\n", body_offset, end),
+    })
+    return entry
+
+
+def _header_fields(raw_headers, policy, default_type):
+    parser = email.parser.BytesParser(policy=policy)
+    headers = parser.parsebytes(raw_headers, headersonly=True)
+    if "Content-Type" not in headers:
+        headers.set_default_type(default_type)
+    
+    params = {}
+    for k, v in (headers.get_params() or [])[1:]:
+        params[k.lower()] = email.utils.collapse_rfc2231_value(v)
+    
+    encoding = _header_str(headers, "Content-Transfer-Encoding")
+    
+    return {
+        "type": headers.get_content_type(),
+        "params": params,
+        "id": _header_str(headers, "Content-ID"),
+        "description": _header_str(headers, "Content-Description"),
+        "encoding": encoding.strip().lower() if encoding else "7bit",
+        "disposition": headers.get_content_disposition(),
+        "filename": headers.get_filename(),
+    }
+
+
+def _split_multipart(content, entry):
+    """
+    Yields (start, end) offsets of each body part between boundary delimiters.
+    The line break before a delimiter belongs to the delimiter (RFC 2046).
+    """
+    boundary = entry["params"].get("boundary")
+    if not boundary:
+        return
+    
+    delimiter = re.compile(rb"^--" + re.escape(boundary.encode("utf8", "surrogateescape")) + rb"(--)?[ \t]*\r?$", re.M)
+    start = None
+    for m in delimiter.finditer(content, entry["body_offset"], entry["end"]):
+        if start is not None:
+            end = m.start()
+            if content.startswith(b"\r\n", end - 2, end):
+                end -= 2
+            elif content.startswith(b"\n", end - 1, end):
+                end -= 1
+            yield start, max(start, end)
+        
+        if m.group(1):
+            return
+        
+        start = m.end()
+        if content.startswith(b"\r\n", start, entry["end"]):
+            start += 2
+        elif content.startswith(b"\n", start, entry["end"]):
+            start += 1
+    
+    # No closing delimiter (e.g. a truncated message); the last part runs
+    # to the end of the multipart.
+    if start is not None:
+        yield start, entry["end"]
+
+
+def _parse_children(content, entry, part, parts, is_message, depth):
+    if depth >= MAX_MIME_DEPTH:
+        return
+    
+    if entry["type"].startswith("multipart/"):
+        default_type = "message/rfc822" if entry["type"] == "multipart/digest" else "text/plain"
+        for number, (start, end) in enumerate(_split_multipart(content, entry), 1):
+            child = _parse_entity(content, start, end, _subpart(part, number), default_type)
+            parts.append(child)
+            _parse_children(content, child, child["part"], parts, False, depth + 1)
+    
+    elif entry["type"] == "message/rfc822" and not is_message:
+        # The encapsulated message's body parts are numbered beneath this part.
+        inner = _parse_entity(content, entry["body_offset"], entry["end"], part)
+        entry["message"] = {
+            "offset": inner["offset"],
+            "body_offset": inner["body_offset"],
+            "end": inner["end"],
+        }
+        _parse_children(content, inner, part, parts, True, depth + 1)
+    
+    elif is_message:
+        # A non-multipart message body is part 1 of that message in IMAP.
+        body = dict(entry)
+        body["part"] = _subpart(part, 1)
+        parts.append(body)
 
 
 class Message(object):
     _content = None
     _date = None
+    _headers = None
+    _structure = None
     subdir = "new"
     msg_id = None
     msg_md5 = None
@@ -65,18 +262,7 @@ class Message(object):
         return str(self).__format__(formatspec)
     
     def _gen_msgid(self):
-        global delivery_number
-        now = datetime.datetime.now()
-        
-        seconds_number = time.time()
-        hostname_string = socket.gethostname()
-        random_number = random.getrandbits(32)
-        microsecond_number = now.microsecond
-        process_number = os.getpgid(0)
-        delivery_number += 1
-        
-        msgid_str = "%d.R%dM%dP%dQ%d.%s" % (seconds_number, random_number, microsecond_number, process_number, delivery_number, hostname_string)
-        return msgid_str
+        return gen_msgid()
     
     @property
     def msgid(self):
@@ -125,6 +311,7 @@ class Message(object):
         self.msg_size = 0
         self.msg_vsize = 0
         self._headers = None
+        self._structure = None
         
     @property
     def content_hash(self):
@@ -143,6 +330,27 @@ class Message(object):
         else:
             return None
     
+    @property
+    def structure(self):
+        """
+        The MIME part list of this message; see parse_structure().
+        """
+        if self._structure is None:
+            self._structure = parse_structure(self._content or b"")
+        return self._structure
+    
+    def get_part(self, part, headers=False):
+        """
+        Returns the raw (still transfer-encoded) body of the given part, or
+        its header block if headers is True.
+        """
+        for entry in self.structure:
+            if entry["part"] == part:
+                if headers:
+                    return self._content[entry["offset"]:entry["body_offset"]]
+                return self._content[entry["body_offset"]:entry["end"]]
+        raise KeyError(part)
+    
     @property
     def date(self):
         if self._date:
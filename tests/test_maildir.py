@@ -0,0 +1,489 @@
+import gc
+import io
+import os
+import re
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from maildir_lite import Maildir, Message
+from maildir_lite import maildir, message
+
+
+MULTIPART = (
+    b"Subject: parts\r\n"
+    b"Content-Type: multipart/mixed; boundary=XX\r\n"
+    b"\r\n"
+    b"--XX\r\n"
+    b"Content-Type: text/plain\r\n"
+    b"\r\n"
+    b"hello\r\n"
+    b"--XX\r\n"
+    b"Content-Type: application/pdf\r\n"
+    b"Content-Transfer-Encoding: base64\r\n"
+    b"\r\n"
+    b"QUJD\r\n"
+    b"--XX--\r\n"
+)
+
+
+def _supports_xattrs(path):
+    if not maildir.has_xattr:
+        return False
+    try:
+        maildir.xattr.setxattr(path, b"user.test", b"1")
+        return True
+    except IOError:
+        return False
+
+
+class StructureTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, "Maildir")
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_get_part(self):
+        md = Maildir(self.path, create=True)
+        key = md.add(MULTIPART)
+        parts = md.get_structure(key)
+        self.assertEqual([p["part"] for p in parts], ["", "1", "2"])
+        self.assertEqual(md.get_part(key, "1"), b"hello")
+        self.assertEqual(md.get_part(key, "2"), b"QUJD")
+        self.assertEqual(md.get_part(key, "2", headers=True),
+                         b"Content-Type: application/pdf\r\nContent-Transfer-Encoding: base64\r\n\r\n")
+        self.assertRaises(KeyError, md.get_part, key, "3")
+
+    def test_unterminated_multipart(self):
+        md = Maildir(self.path, create=True)
+        key = md.add(MULTIPART[:-len(b"\r\n--XX--\r\n")])
+        self.assertEqual([p["part"] for p in md.get_structure(key)], ["", "1", "2"])
+        self.assertEqual(md.get_part(key, "1"), b"hello")
+        self.assertEqual(md.get_part(key, "2"), b"QUJD")
+
+    def test_get_part_after_rename(self):
+        md = Maildir(self.path, create=True)
+        key = md.add(MULTIPART)
+        md.get_structure(key)
+        old_path = md._path_for_key(key)
+
+        # Another thread moves it to cur/ right after we look it up.
+        new_path = md._path_for_key(md.get_message(key).msgid)
+        with mock.patch.object(md, "_path_for_key", side_effect=[old_path, new_path]):
+            self.assertEqual(md.get_part(key, "2"), b"QUJD")
+
+        os.remove(new_path)
+        with mock.patch.object(md, "_path_for_key", return_value=new_path):
+            self.assertRaises(KeyError, md.get_part, key, "2")
+
+    def test_empty_message(self):
+        md = Maildir(self.path, create=True)
+        key = md.add(b"")
+        self.assertEqual([p["part"] for p in md.get_structure(key)], ["", "1"])
+        self.assertEqual(md.get_part(key, ""), b"")
+
+    def test_malformed_content_type(self):
+        md = Maildir(self.path, create=True)
+        key = md.add(MULTIPART.replace(b"application/pdf", b"application/pdf; name*"))
+        parts = md.get_structure(key)
+        self.assertEqual([p["part"] for p in parts], ["", "1", "2"])
+        self.assertEqual(parts[2]["type"], "application/pdf")
+        self.assertEqual(md.get_part(key, "2"), b"QUJD")
+
+    def test_structure_persists(self):
+        md = Maildir(self.path, create=True, xattr=True)
+        if not _supports_xattrs(md.path):
+            self.skipTest("no xattr support")
+        key = md.add(MULTIPART)
+        parts = md.get_structure(key)
+
+        # Drop the shared in-process cache along with the last instance.
+        del md
+        gc.collect()
+
+        md = Maildir(self.path, xattr=True)
+        with mock.patch("maildir_lite.message.parse_structure", side_effect=AssertionError("reparsed")):
+            self.assertEqual(md.get_structure(key), parts)
+            self.assertEqual(md.get_part(key, "2"), b"QUJD")
+
+
+MSGID = re.compile(r"^(\d+)\.R(\d+)M(\d+)P(\d+)Q(\d+)\.(.+)$")
+
+
+class MsgidTest(unittest.TestCase):
+    def test_format(self):
+        first = MSGID.match(message.gen_msgid())
+        second = MSGID.match(message.gen_msgid())
+        self.assertIsNotNone(first)
+        self.assertEqual(int(first.group(4)), os.getpid())
+        self.assertLess(int(first.group(3)), 1000000)
+        self.assertEqual(int(second.group(5)), int(first.group(5)) + 1)
+
+    def test_hostname_escaped(self):
+        try:
+            with mock.patch("socket.gethostname", return_value="a/b:c,d"):
+                message._reset_msgid_constants()
+            msgid = message.gen_msgid()
+        finally:
+            message._reset_msgid_constants()
+        self.assertTrue(msgid.endswith(".a\\057b\\072c\\054d"), msgid)
+        self.assertEqual(MSGID.match(msgid).group(5), "1")
+
+    @unittest.skipUnless(hasattr(os, "fork") and hasattr(os, "register_at_fork"), "no fork")
+    def test_reset_after_fork(self):
+        message.gen_msgid()
+        message.gen_msgid()
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.write(w, message.gen_msgid().encode("utf8"))
+            finally:
+                os._exit(0)
+        os.close(w)
+        with os.fdopen(r, "rb") as f:
+            msgid = f.read().decode("utf8")
+        os.waitpid(pid, 0)
+
+        m = MSGID.match(msgid)
+        self.assertEqual(int(m.group(4)), pid)
+        self.assertEqual(m.group(5), "1")
+
+    def test_open_tmp_retries(self):
+        root = tempfile.mkdtemp()
+        try:
+            md = Maildir(os.path.join(root, "Maildir"), create=True)
+            taken = os.path.join(md.paths["tmp"], "taken")
+            with open(taken, "wb") as f:
+                f.write(b"someone else's delivery")
+
+            msg = Message(b"Subject: x\n\n", msgid="taken")
+            with mock.patch.object(maildir, "gen_msgid", return_value="fresh"):
+                tmp_path, f = md._open_tmp(msg)
+            f.close()
+
+            self.assertEqual(tmp_path, os.path.join(md.paths["tmp"], "fresh"))
+            self.assertEqual(msg.msg_id, "fresh")
+            with open(taken, "rb") as f:
+                self.assertEqual(f.read(), b"someone else's delivery")
+        finally:
+            shutil.rmtree(root)
+
+
+class ConcurrencyTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, "Maildir")
+        self.md = Maildir(self.path, create=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_add_remove_keys(self):
+        errors = []
+        done = threading.Event()
+
+        def writer():
+            md = Maildir(self.path)
+            try:
+                for i in range(100):
+                    md.add(b"Subject: %d\n\n" % i + b"x" * 4096)
+            except Exception as e:
+                errors.append(e)
+
+        def reader():
+            md = Maildir(self.path)
+            try:
+                while not done.is_set():
+                    for key in md.keys():
+                        try:
+                            md.get_message(key)
+                        except KeyError:
+                            pass # removed meanwhile
+            except Exception as e:
+                errors.append(e)
+
+        def remover():
+            md = Maildir(self.path)
+            try:
+                while not done.is_set():
+                    for key in md.keys()[:3]:
+                        try:
+                            md.remove(key)
+                        except KeyError:
+                            pass # removed meanwhile
+            except Exception as e:
+                errors.append(e)
+
+        writers = [threading.Thread(target=writer) for i in range(4)]
+        others = [threading.Thread(target=reader) for i in range(4)]
+        others.append(threading.Thread(target=remover))
+        for t in writers + others:
+            t.start()
+        for t in writers:
+            t.join()
+        done.set()
+        for t in others:
+            t.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(os.listdir(os.path.join(self.path, "tmp")), [])
+
+        keys = self.md.keys()
+        on_disk = os.listdir(os.path.join(self.path, "new")) + os.listdir(os.path.join(self.path, "cur"))
+        self.assertEqual(len(keys), len(on_disk))
+        for key in keys:
+            self.assertTrue(self.md.get_message(key).content.startswith(b"Subject: "))
+
+    def test_add_existing_msgid(self):
+        key = self.md.add(b"Subject: one\n\nbody\n", info="2,S")
+        other = self.md.add(b"Subject: one\n\nbody\n", msgid=key, info="2,S")
+        self.assertNotEqual(key, other)
+        self.assertEqual(sorted(self.md.keys()), sorted([key, other]))
+
+        # Also when the existing message isn't in the key index yet.
+        content = b"Subject: two\n\nbody\n"
+        external = Message(content, msgid="external").msgid
+        with open(os.path.join(self.path, "new", external), "wb") as f:
+            f.write(content)
+        third = self.md.add(content, msgid="external")
+        self.assertNotEqual(third, external)
+        self.assertEqual(len(os.listdir(os.path.join(self.path, "new"))), 2)
+
+    def test_add_existing_msgid_other_flags(self):
+        content = b"Subject: one\n\nbody\n"
+        key = self.md.add(content, info="2,FS")
+
+        # A fresh index that has never listed the existing message.
+        del self.md
+        gc.collect()
+        md = Maildir(self.path)
+
+        other = md.add(content, msgid=key, info="2,S")
+        self.assertNotEqual(key, other)
+        self.assertEqual(sorted(md.keys()), sorted([key, other]))
+        self.assertEqual(len(os.listdir(os.path.join(self.path, "cur"))), 2)
+
+    def test_get_message_keeps_index(self):
+        key = self.md.add(b"Subject: new\n\nbody\n")
+        self.md.keys()
+        last_update = self.md._index.last_update
+
+        # Moving the message to cur/ updates the index in place.
+        self.assertEqual(self.md.get_message(key).subdir, "cur")
+        self.assertEqual(self.md._index.last_update, last_update)
+        self.assertEqual(self.md.keys(), [key])
+
+    def test_structure_not_cached_after_remove(self):
+        key = self.md.add(MULTIPART)
+        parse = message.parse_structure
+
+        def parse_then_remove(content):
+            Maildir(self.path).remove(key)
+            return parse(content)
+
+        with mock.patch("maildir_lite.message.parse_structure", side_effect=parse_then_remove):
+            self.md.get_structure(key)
+        self.assertNotIn(key, self.md._index.structures)
+
+    def test_keys_skip_tmp(self):
+        with open(os.path.join(self.path, "tmp", "in-progress"), "wb") as f:
+            f.write(b"Subject: partial\n")
+        key = self.md.add(b"Subject: done\n\nbody\n")
+        self.assertEqual(self.md.keys(), [key])
+        self.assertEqual(len(Maildir(self.path).keys()), 1)
+
+
+class MboxTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, "Maildir")
+        self.md = Maildir(self.path, create=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def contents(self):
+        return sorted(self.md.get_message(key).content for key in self.md.keys())
+
+    def stored(self, md):
+        """
+        (first line, subdir, info) of each message, without moving any.
+        """
+        found = []
+        for key in md.keys():
+            path = md._path_for_key(key)
+            with open(path, "rb") as f:
+                found.append((f.readline(), os.path.basename(os.path.dirname(path)), path.partition(":")[2]))
+        return sorted(found)
+
+    def test_unquoted_from_in_body(self):
+        mbox = (
+            b"From a Wed Oct  8 10:00:00 2025\n"
+            b"Subject: one\n"
+            b"\n"
+            b"body\n"
+            b"From real\n"
+            b"\n"
+            b"From b Wed Oct  8 10:00:00 2025\n"
+            b"Subject: two\n"
+            b"\n"
+            b"x\n"
+        )
+        self.assertEqual(self.md.import_mbox(io.BytesIO(mbox)), 2)
+        self.assertEqual(self.contents(), [
+            b"Subject: one\n\nbody\nFrom real\n",
+            b"Subject: two\n\nx\n",
+        ])
+
+    def test_skip_empty_messages(self):
+        mbox = b"From a\n\nFrom b\nSubject: one\n\nbody\n\nFrom c\n\n"
+        self.assertEqual(self.md.import_mbox(io.BytesIO(mbox)), 1)
+        self.assertEqual(self.contents(), [b"Subject: one\n\nbody\n"])
+        self.assertEqual(os.listdir(os.path.join(self.path, "tmp")), [])
+
+
+    def test_flags_round_trip(self):
+        mbox = (
+            b"From a Wed Oct  8 10:00:00 2025\n"
+            b"Subject: read\n"
+            b"Status: RO\n"
+            b"X-Status: AF\n"
+            b"\n"
+            b"one\n"
+            b"\n"
+            b"From b Wed Oct  8 10:00:00 2025\n"
+            b"Subject: draft\n"
+            b"X-Status: TD\n"
+            b"  continued\n"
+            b"\n"
+            b"two\n"
+            b"\n"
+            b"From c Wed Oct  8 10:00:00 2025\n"
+            b"Subject: unread\n"
+            b"\n"
+            b"three\n"
+        )
+        self.assertEqual(self.md.import_mbox(io.BytesIO(mbox)), 3)
+
+        self.assertEqual(self.stored(self.md), [
+            (b"Subject: draft\n", "cur", "2,DT"),
+            (b"Subject: read\n", "cur", "2,FRS"),
+            (b"Subject: unread\n", "new", ""),
+        ])
+        for key in self.md.keys():
+            self.assertNotIn(b"Status", open(self.md._path_for_key(key), "rb").read())
+
+        out = io.BytesIO()
+        self.assertEqual(self.md.export_mbox(out), 3)
+        exported = out.getvalue()
+        self.assertIn(b"Subject: read\nStatus: RO\nX-Status: AF\n\none\n\n", exported)
+        self.assertIn(b"Subject: draft\nStatus: O\nX-Status: TD\n\ntwo\n\n", exported)
+        self.assertIn(b"Subject: unread\n\nthree\n\n", exported)
+
+        # And back again, unchanged.
+        other = Maildir(os.path.join(self.root, "Other"), create=True)
+        self.assertEqual(other.import_mbox(io.BytesIO(exported)), 3)
+        self.assertEqual(self.stored(other), self.stored(self.md))
+        self.assertEqual(sorted(other.get_message(k).content for k in other.keys()), self.contents())
+
+    def test_from_quoting(self):
+        content = b"Subject: q\n\nFrom here\n>From there\n>>From everywhere\nnot From\n"
+        self.md.add(content)
+
+        out = io.BytesIO()
+        self.md.export_mbox(out)
+        exported = out.getvalue()
+        self.assertTrue(exported.startswith(b"From MAILER-DAEMON "))
+        self.assertTrue(exported.endswith(
+            b"\n>From here\n>>From there\n>>>From everywhere\nnot From\n\n"))
+
+        other = Maildir(os.path.join(self.root, "Other"), create=True)
+        other.import_mbox(io.BytesIO(exported))
+        self.assertEqual([other.get_message(k).content for k in other.keys()], [content])
+
+    def test_separator_added(self):
+        # A message without a trailing newline still gets one, plus the
+        # blank separator line.
+        self.md.add(b"Subject: a\n\nno newline")
+        out = io.BytesIO()
+        self.md.export_mbox(out)
+        self.assertTrue(out.getvalue().endswith(b"\n\nno newline\n\n"))
+
+    def test_crlf(self):
+        mbox = (
+            b"From a Wed Oct  8 10:00:00 2025\r\n"
+            b"Subject: one\r\n"
+            b"Status: R\r\n"
+            b"\r\n"
+            b">From body\r\n"
+            b"\r\n"
+            b"From b Wed Oct  8 10:00:00 2025\r\n"
+            b"Subject: two\r\n"
+            b"\r\n"
+            b"body\r\n"
+        )
+        self.assertEqual(self.md.import_mbox(io.BytesIO(mbox)), 2)
+        self.assertEqual(self.contents(), [
+            b"Subject: one\r\n\r\nFrom body\r\n",
+            b"Subject: two\r\n\r\nbody\r\n",
+        ])
+
+        out = io.BytesIO()
+        self.md.export_mbox(out)
+        self.assertIn(b"Subject: one\r\nStatus: RO\r\n\r\n>From body\r\n", out.getvalue())
+
+    def test_long_lines(self):
+        long_from = b"From " + b"x" * 50 + b" Wed Oct  8 10:00:00 2025\n"
+        body = b"y" * 20 + b"From " + b"z" * 30 + b"\n"
+        mbox = (
+            long_from + b"Subject: " + b"s" * 40 + b"\nStatus: RO\n\n" + body + b"\n" +
+            long_from + b"Subject: two\n\nshort\n"
+        )
+        with mock.patch.object(maildir, "MBOX_CHUNK_SIZE", 16):
+            self.assertEqual(self.md.import_mbox(io.BytesIO(mbox)), 2)
+            self.assertEqual(self.contents(), [
+                b"Subject: " + b"s" * 40 + b"\n\n" + body,
+                b"Subject: two\n\nshort\n",
+            ])
+
+            out = io.BytesIO()
+            self.md.export_mbox(out)
+            self.assertIn(b"\n\n" + body + b"\n", out.getvalue())
+
+    def test_batches(self):
+        mbox = b"".join(b"From a\nSubject: %d\n\nbody\n\n" % i for i in range(5))
+        index = self.md._index
+        seen = []
+
+        class Reader(io.BytesIO):
+            def readline(self, size=-1):
+                seen.append(len(index.keys))
+                return super().readline(size)
+
+        with mock.patch.object(maildir, "MBOX_BATCH_SIZE", 2):
+            self.assertEqual(self.md.import_mbox(Reader(mbox)), 5)
+        # Keys appear two at a time while reading, the rest at the end.
+        self.assertEqual(sorted(set(seen)), [0, 2, 4])
+        self.assertEqual(len(index.keys), 5)
+
+    def test_read_error_cleans_tmp(self):
+        class Failing(io.BytesIO):
+            def readline(self, size=-1):
+                line = super().readline(size)
+                if line == b"half\n":
+                    raise IOError("disk went away")
+                return line
+
+        mbox = b"From a\nSubject: one\n\nbody\n\nFrom b\nSubject: two\n\nhalf\n"
+        self.assertRaises(IOError, self.md.import_mbox, Failing(mbox))
+        self.assertEqual(os.listdir(os.path.join(self.path, "tmp")), [])
+        self.assertEqual(self.contents(), [b"Subject: one\n\nbody\n"])
+
+
+if __name__ == "__main__":
+    unittest.main()